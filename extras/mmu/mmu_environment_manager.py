@@ -42,19 +42,19 @@
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 #
-import ast, logging
+import ast, logging, re
 
 # Happy Hare imports
 from ..mmu_machine         import VENDOR_VVD
 
-# MMU subcomponent clases
-from .mmu_shared           import *
-
 
 class MmuEnvironmentManager:
 
     CHECK_INTERVAL = 30 # How often to check heater and environment sensors (seconds)
 
+    # Validates comma separated GATES parameter
+    GATES_PATTERN = re.compile(r'^\s*[+-]?\d+(\s*,\s*[+-]?\d+)*\s*$')
+
     # Environment sensor chips with humidity
     ENV_SENSOR_CHIPS = ["bme280", "htu21d", "sht3x", "lm75", "aht10"]
 
@@ -79,7 +79,7 @@ class MmuEnvironmentManager:
         self.heater_rotate_interval  = self.mmu.config.getfloat('heater_rotate_interval', 5, minval=1)
 
         # Build tuples of drying temp / drying time indexed by filament type
-        drying_data_str = self.mmu.config.get('drying_data', {})
+        drying_data_str = self.mmu.config.get('drying_data', '{}')
         try:
             drying_data = ast.literal_eval(drying_data_str)
             # Store as upper case keys (If there are duplicate keys differing only by case, the last one wins)
@@ -95,6 +95,9 @@ class MmuEnvironmentManager:
         # Register GCODE commands ---------------------------------------------------------------------------
         self.mmu.gcode.register_command('MMU_HEATER', self.cmd_MMU_HEATER, desc=self.cmd_MMU_HEATER_help)
 
+        self._env_sensor_cache = {} # sensor name -> (temperature object, humidity object)
+        self._heater_help = None    # Formatted MMU_HEATER help (built on first request)
+
         self._periodic_timer = self.mmu.reactor.register_timer(self._check_mmu_environment)
         self.reinit()
 
@@ -108,6 +111,7 @@ class MmuEnvironmentManager:
         self._drying_humidity_target = None
         self._drying_start_time = self._drying_end_time = None
         self._drying_gates = []
+        self._drying_gates_str = ""
         self._drying_vent_interval = None
 
         # Per-gate drying state (multi-heater mode)
@@ -196,6 +200,14 @@ class MmuEnvironmentManager:
         return self.mmu.mmu_machine.environment_sensor != ''
 
 
+    def _get_full_gates(self):
+        """
+        Return list of gates that are not known to be empty
+        """
+        gate_empty = self.mmu.GATE_EMPTY
+        return [i for i, status in enumerate(self.mmu.gate_status) if status != gate_empty]
+
+
     def _get_active_gates(self):
         """
         Return list of active gates from per-gate drying states
@@ -227,12 +239,16 @@ class MmuEnvironmentManager:
         if self.mmu.check_if_disabled(): return
 
         if gcmd.get_int('HELP', 0, minval=0, maxval=1):
-            self.mmu.log_always(self.mmu.format_help(self.cmd_MMU_HEATER_param_help), color=True)
+            if self._heater_help is None:
+                self._heater_help = self.mmu.format_help(self.cmd_MMU_HEATER_param_help)
+            self.mmu.log_always(self._heater_help, color=True)
             return
 
         if not self.has_heater():
             raise gcmd.error("No MMU heater configured")
 
+        now = self.mmu.reactor.monotonic() # Single clock sample for this command
+
         drying_data = gcmd.get_int('DRYING_DATA', 0, minval=0, maxval=1)
         stop = gcmd.get_int('STOP', None, minval=0, maxval=1)
         dry = gcmd.get_int('DRY', None, minval=0, maxval=1)
@@ -254,35 +270,12 @@ class MmuEnvironmentManager:
         if gates_str != "!":
             # Supplied list of gates
             gates_param = True
-            try:
-                for gate in gates_str.split(','):
-                    gate = int(gate)
-                    if 0 <= gate < self.mmu.num_gates:
-                        gates.append(gate)
-            except ValueError:
+            if not self.GATES_PATTERN.match(gates_str):
                 raise gcmd.error("Invalid GATES parameter: %s" % gates_str)
+            num_gates = self.mmu.num_gates
+            gates = [g for g in map(int, gates_str.split(',')) if 0 <= g < num_gates]
         else:
-            gates_param = False
-            all_gates = list(range(self.mmu.num_gates))
-            empty_gates = [
-                i for i, status in enumerate(self.mmu.gate_status)
-                if status == self.mmu.GATE_EMPTY
-            ]
-            full_gates = [
-                i for i, status in enumerate(self.mmu.gate_status)
-                if status != self.mmu.GATE_EMPTY
-            ]
-
-        def _format_minutes(minutes):
-            hours, mins = divmod(int(minutes), 60)
-            parts = []
-            if hours:
-                parts.append("%d hour%s" % (hours, "" if hours == 1 else "s"))
-            if mins:
-                parts.append("%d minute%s" % (mins, "" if mins == 1 else "s"))
-            if not (hours or mins):
-                parts.append("<1 minute")
-            return " ".join(parts)
+            gates_param = False # Default gate list is built only by the branch that needs it
 
         # Display drying data table ---------------------------------------------
         if drying_data:
@@ -290,7 +283,7 @@ class MmuEnvironmentManager:
             for material in sorted(self.drying_data.keys()):
                 t, minutes = self.drying_data[material]
                 # Avoid format() on unicode with alignment in Py2 edge-cases; keep it simple
-                msg += u"%s %s°C for %s\n" % (material + ":", int(t), _format_minutes(minutes))
+                msg += u"%s %s°C for %s\n" % (material + ":", int(t), self._format_minutes(minutes))
             self.mmu.log_always(msg)
             return
 
@@ -298,7 +291,7 @@ class MmuEnvironmentManager:
         if stop or temp == 0:
             if self._has_per_gate_heaters():
                 if not gates_param:
-                    gates = all_gates
+                    gates = list(range(self.mmu.num_gates))
 
                 if self.is_drying():
                     # STOP=1 with explicit GATES=... cancels only those gates in multi-heater mode
@@ -338,7 +331,7 @@ class MmuEnvironmentManager:
         # Raw heater control ----------------------------------------------------
         if not dry and temp is not None:
             if not gates_param:
-                gates = full_gates # Default to all non empty gates
+                gates = self._get_full_gates() # Default to all non empty gates
 
             # In per-gate mode, apply TEMP to the selected gate heaters
             if self._has_per_gate_heaters():
@@ -402,7 +395,7 @@ class MmuEnvironmentManager:
                 raise gcmd.error("ROTATE requires explicit GATES parameter")
 
             if not rotate and not gates_param:
-                gates = full_gates # Default to all non empty gates
+                gates = self._get_full_gates() # Default to all non empty gates
 
             if rotate:
                 for gate in gates:
@@ -444,15 +437,17 @@ class MmuEnvironmentManager:
                         timer = longest
                         info = "longest"
                     self.mmu.log_info(u"Defaulting to lowest drying temperature of %.1f°C for %s %s given filaments types currently in MMU"
-                                      % (temp, info, _format_minutes(timer)))
+                                      % (temp, info, self._format_minutes(timer)))
 
             # Note that in multi-heater mode, each gate's temp and end_time is tracked independently
             self._drying_time = timer or self.heater_default_dry_time
+            self._drying_time_str = self._format_minutes(self._drying_time) # Constant for the cycle
             self._drying_temp = temp or self.heater_default_dry_temp
             self._drying_humidity_target = humidity
-            self._drying_start_time = self.mmu.reactor.monotonic()
+            self._drying_start_time = now
             self._drying_end_time = self._drying_start_time + self._drying_time * 60
             self._drying_gates = gates
+            self._drying_gates_str = ",".join(map(str, gates))
             self._drying_vent_interval = vent_interval
             self._drying_rotate_interval = rotate_interval
 
@@ -465,7 +460,7 @@ class MmuEnvironmentManager:
                 self._rotate_timer = None
 
             # Initiate drying cycle
-            self._start_drying_cycle(per_gate_plan)
+            self._start_drying_cycle(per_gate_plan, eventtime=now)
             msg = u"MMU filament drying cycle started:"
 
         elif self.is_drying():
@@ -509,16 +504,14 @@ class MmuEnvironmentManager:
 
         # Display status report of drying cycle ---------------------------------
         if self.is_drying():
-            now = self.mmu.reactor.monotonic()
-
             if self._drying_gates:
-                msg += u"\nDrying filaments in gates: %s" % u",".join(str(g) for g in self._drying_gates)
+                msg += u"\nDrying filaments in gates: %s" % self._drying_gates_str
 
             if not self._has_per_gate_heaters():
                 # Single heater status report
-                remaining_mins = _format_minutes((self._drying_end_time - now) // 60)
+                remaining_mins = self._format_minutes((self._drying_end_time - now) // 60)
                 cur_temp, cur_humidity = self._get_environment_status()
-                msg += u"\nCycle time: %s (remaining: %s)" % (_format_minutes(self._drying_time), remaining_mins)
+                msg += u"\nCycle time: %s (remaining: %s)" % (self._drying_time_str, remaining_mins)
                 if cur_temp is not None:
                     msg += u"\nTarget humidity: %.1f%%" % self._drying_humidity_target
                     if cur_humidity is not None:
@@ -543,7 +536,7 @@ class MmuEnvironmentManager:
                     end_t = gd.get('end_time', None)
                     if end_t is not None and state == self.DRYING_STATE_ACTIVE:
                         rem = max(0, int((end_t - now) // 60))
-                        rem_txt = _format_minutes(rem)
+                        rem_txt = self._format_minutes(rem)
                     else:
                         rem_txt = None
 
@@ -572,8 +565,8 @@ class MmuEnvironmentManager:
             if self._vent_timer is not None:
                 msg += u"\nVenting operational (running macro %s every %s, next in %s)" % (
                     self.heater_vent_macro,
-                    _format_minutes(self._drying_vent_interval),
-                    _format_minutes(max(self.CHECK_INTERVAL, self._vent_timer) / 60),
+                    self._format_minutes(self._drying_vent_interval),
+                    self._format_minutes(max(self.CHECK_INTERVAL, self._vent_timer) / 60),
                 )
             else:
                 if not self.heater_vent_macro:
@@ -585,8 +578,8 @@ class MmuEnvironmentManager:
             # Rotation status (eSpooler)
             if self._rotate_enabled:
                 msg += u"\nSpool rotation enabled (running every %s, next in %s)" % (
-                    _format_minutes(self._drying_rotate_interval),
-                    _format_minutes(max(self.CHECK_INTERVAL, self._rotate_timer) / 60),
+                    self._format_minutes(self._drying_rotate_interval),
+                    self._format_minutes(max(self.CHECK_INTERVAL, self._rotate_timer) / 60),
                 )
             elif self.mmu.has_espooler():
                 msg += u"\nSpool rotation not enabled"
@@ -618,6 +611,7 @@ class MmuEnvironmentManager:
         self._stop_drying_cycle(reset_state=True)
         self._heater_off()
         self.spools_to_rotate = []
+        self._env_sensor_cache = {}
 
 
     def _handle_mmu_enabled(self):
@@ -634,7 +628,7 @@ class MmuEnvironmentManager:
         if not self.is_drying():
             return self.mmu.reactor.NEVER
 
-        now = self.mmu.reactor.monotonic()
+        now = eventtime
 
         # Per-gate drying mode
         if self._has_per_gate_heaters():
@@ -757,7 +751,7 @@ class MmuEnvironmentManager:
         return eventtime + self.CHECK_INTERVAL
 
 
-    def _start_drying_cycle(self, per_gate_plan=None):
+    def _start_drying_cycle(self, per_gate_plan=None, eventtime=None):
         if self.is_drying():
             return
 
@@ -817,7 +811,7 @@ class MmuEnvironmentManager:
                     pass
 
             # Turn heater on if possible else queue
-            self._start_next_queued_gates(self.mmu.reactor.monotonic())
+            self._start_next_queued_gates(eventtime if eventtime is not None else self.mmu.reactor.monotonic())
 
         # Enable
         self.mmu.reactor.update_timer(self._periodic_timer, self.mmu.reactor.NOW)
@@ -879,6 +873,7 @@ class MmuEnvironmentManager:
 
             self._drying_queue = []
             self._drying_gates = []
+            self._drying_gates_str = ""
 
             if reset_state:
                 self._drying_state = [self.DRYING_STATE_NONE] * self.mmu.num_gates
@@ -991,6 +986,21 @@ class MmuEnvironmentManager:
             self.mmu.gcode.run_script_from_command("SET_HEATER_TEMPERATURE HEATER=%s TARGET=0" % hname)
 
 
+    def _format_minutes(self, minutes):
+        """
+        Return human readable duration string for whole minutes
+        """
+        hours, mins = divmod(int(minutes), 60)
+        parts = []
+        if hours:
+            parts.append("%d hour%s" % (hours, "" if hours == 1 else "s"))
+        if mins:
+            parts.append("%d minute%s" % (mins, "" if mins == 1 else "s"))
+        if not (hours or mins):
+            parts.append("<1 minute")
+        return " ".join(parts)
+
+
     def _heater_name(self, heater_obj_name):
         """
         Return just the simple heater name from the heater object name
@@ -1033,24 +1043,26 @@ class MmuEnvironmentManager:
                 return None, None
             sensor = sensors[gate]
 
-        obj = self.mmu.printer.lookup_object(sensor, None)
-        if obj is None:
-            return None, None
-
-        status = obj.get_status(0)
-        temperature = status.get('temperature')
-
-        # See if chip supports humidity (we hope so)
-        humidity = None
-        p = sensor.split()
-        s_name = p[1] if len(p) > 1 else None
-        if s_name:
-            for chip in self.ENV_SENSOR_CHIPS:
-                obj = self.mmu.printer.lookup_object("%s %s" % (chip, s_name), None)
-                if obj:
-                    humidity = obj.get_status(0).get('humidity')
-                    break
-
+        cached = self._env_sensor_cache.get(sensor)
+        if cached is None:
+            obj = self.mmu.printer.lookup_object(sensor, None)
+            if obj is None:
+                return None, None # Not cached so it will be retried
+
+            # See if chip supports humidity (we hope so)
+            humidity_obj = None
+            p = sensor.split()
+            s_name = p[1] if len(p) > 1 else None
+            if s_name:
+                for chip in self.ENV_SENSOR_CHIPS:
+                    humidity_obj = self.mmu.printer.lookup_object("%s %s" % (chip, s_name), None)
+                    if humidity_obj:
+                        break
+            cached = self._env_sensor_cache[sensor] = (obj, humidity_obj)
+
+        obj, humidity_obj = cached
+        temperature = obj.get_status(0).get('temperature')
+        humidity = humidity_obj.get_status(0).get('humidity') if humidity_obj else None
         return (temperature, humidity)
 
 
@@ -1094,44 +1106,6 @@ class MmuEnvironmentManager:
                 self._rotate_spool(self.spools_to_rotate[0])
 
 
-    def _get_max_drying_temp_time(self, gates):
-        """
-        For the given gates, look up each gate's material to find drying data (temp/time)
-        Return (lowest_temp, longest_time) across the set.
-
-        If a material is not found in self.drying_data, use:
-          - self.heater_default_dry_temp
-          - self.heater_default_dry_time
-        """
-        default_temp = self.heater_default_dry_temp
-        default_time = self.heater_default_dry_time
-
-        lowest_temp = None
-        longest_time = None
-
-        for gate in gates:
-            material = self.mmu.gate_material[gate]
-            key = str(material).upper()
-
-            temp, duration = self.drying_data.get(key, (default_temp, default_time))
-
-            # Track lowest temperature
-            if lowest_temp is None or temp < lowest_temp:
-                lowest_temp = temp
-
-            # Track longest time
-            if longest_time is None or duration > longest_time:
-                longest_time = duration
-
-        # If no matching materials return defaults
-        if lowest_temp is None:
-            lowest_temp = default_temp
-        if longest_time is None:
-            longest_time = default_time
-
-        return (lowest_temp, longest_time)
-
-
     def _get_drying_plan(self, gates):
         """
         For the given gates, look up each gate's material to find drying data (temp/time).
@@ -276,7 +276,7 @@ class MmuTest:
                     for sensor in sensors_to_remove:
                         self.mmu.printer.objects.pop("filament_switch_sensor %s_sensor"  % sensor)
                         config.fileconfig.pop("filament_switch_sensor %s_sensor"  % sensor)
-                        mmu_sensors.sensors.pop(sensor)
+                        mmu_sensors.remove_sensor(sensor)
                         share_name = "%s:%s" % (ppins.parse_pin('test_'+sensor+'_pin')['chip_name'], ppins.parse_pin('test_'+sensor+'_pin')['pin'])
                         ppins.active_pins.pop(share_name)
                         for cmd, (__, val) in self.mmu.gcode.mux_commands.items() :
@@ -37,8 +37,6 @@
 
 import logging, time
 
-import configparser, configfile
-
 INSERT_GCODE = "__MMU_SENSOR_INSERT"
 REMOVE_GCODE = "__MMU_SENSOR_REMOVE"
 RUNOUT_GCODE = "__MMU_SENSOR_RUNOUT"
@@ -46,6 +44,26 @@ CLOG_GCODE   = "__MMU_SENSOR_CLOG"
 TANGLE_GCODE = "__MMU_SENSOR_TANGLE"
 
 
+# Build the event gcode command for a sensor, or None if the event is not enabled
+def _sensor_gcode(prefix, name, gate=None, enabled=True):
+    if not enabled:
+        return None
+    if gate is not None:
+        return "%s SENSOR=%s GATE=%d" % (prefix, name, gate)
+    return "%s SENSOR=%s" % (prefix, name)
+
+
+# Build the event gcode dict passed to MmuRunoutHelper for the enabled events of a sensor
+def _sensor_gcodes(name, gate=None, insert=False, remove=False, runout=False, clog=False, tangle=False):
+    return {
+        "insert": _sensor_gcode(INSERT_GCODE, name, gate, insert),
+        "remove": _sensor_gcode(REMOVE_GCODE, name, gate, remove),
+        "runout": _sensor_gcode(RUNOUT_GCODE, name, gate, runout),
+        "clog":   _sensor_gcode(CLOG_GCODE,   name, gate, clog),
+        "tangle": _sensor_gcode(TANGLE_GCODE, name, gate, tangle),
+    }
+
+
 # -------------------------------------------------------------------------------------------------
 # Enhanced "runout helper" that gives greater control of when filament sensor events are fired and
 # direct access to button events in addition to creating a "remove" / "runout" distinction
@@ -62,10 +80,17 @@ class MmuRunoutHelper:
         # Expecting a dict with keys like "insert", "remove", "runout", "clog", "tangle"
         self.gcodes = gcodes or {}
 
+        # Command text up to the eventtime so each event only appends the time
+        self._event_prefixes = dict((k, "%s EVENTTIME=" % v) for k, v in self.gcodes.items() if v)
+        self._insert_prefix = self._event_prefixes.get("insert")
+        self._remove_prefix = self._event_prefixes.get("remove")
+        self._runout_prefix = self._event_prefixes.get("runout")
+
         self.insert_remove_in_print = insert_remove_in_print
         self.button_handler = button_handler
         self.switch_pin = switch_pin
         self.reactor = self.printer.get_reactor()
+        self._monotonic = self.reactor.monotonic
         self.gcode = self.printer.lookup_object('gcode')
 
         self.min_event_systime = self.reactor.NEVER
@@ -74,6 +99,11 @@ class MmuRunoutHelper:
         self.sensor_enabled = True
         self.runout_suspended = None
         self.button_handler_suspended = False
+        self._pending_events = [] # (handler, args) waiting for their reactor callback
+        self._pause_resume = None # Resolved at klippy:ready
+        self._print_stats = self._idle_timeout = None
+        self._is_printing = self._is_printing_lookup # Specialized at klippy:ready
+        self._status_key = self._status = None # Last status dict and the state it was built from
 
         self.printer.register_event_handler("klippy:ready", self._handle_ready)
 
@@ -90,25 +120,47 @@ class MmuRunoutHelper:
 
 
     def _handle_ready(self):
-        self.min_event_systime = self.reactor.monotonic() + 2. # Time to wait before first events are processed
+        self._pause_resume = self.printer.lookup_object('pause_resume', None)
+        # Read the plain 'state' attribute rather than building a full status dict per event. If a
+        # klipper variant doesn't have it we stay with the get_status() lookup
+        self._print_stats = self.printer.lookup_object("print_stats", None)
+        if self._print_stats is not None:
+            if hasattr(self._print_stats, 'state'):
+                self._is_printing = self._is_printing_print_stats
+        else:
+            self._idle_timeout = self.printer.lookup_object("idle_timeout", None)
+            if hasattr(self._idle_timeout, 'state'):
+                self._is_printing = self._is_printing_idle_timeout
+        self.min_event_systime = self._monotonic() + 2. # Time to wait before first events are processed
+
+
+    def _schedule_event(self, handler, *args):
+        self.min_event_systime = self.reactor.NEVER # Prevent more callbacks until this one is complete
+        self._pending_events.append((handler, args))
+        self.reactor.register_callback(self._run_pending_event)
+
+
+    def _run_pending_event(self, eventtime):
+        handler, args = self._pending_events.pop(0)
+        handler(*args)
 
 
     def _insert_event_handler(self, eventtime):
-        insert_gcode = self.gcodes.get("insert")
-        self._exec_gcode("%s EVENTTIME=%s" % (insert_gcode, eventtime) if insert_gcode else None)
+        prefix = self._insert_prefix
+        self._exec_gcode(prefix + str(eventtime) if prefix else None)
 
 
     def _remove_event_handler(self, eventtime):
-        remove_gcode = self.gcodes.get("remove")
-        self._exec_gcode("%s EVENTTIME=%s" % (remove_gcode, eventtime) if remove_gcode else None)
+        prefix = self._remove_prefix
+        self._exec_gcode(prefix + str(eventtime) if prefix else None)
 
 
     def _runout_event_handler(self, eventtime, event_type):
         # Pausing from inside an event requires that the pause portion of pause_resume execute immediately.
-        pause_resume = self.printer.lookup_object('pause_resume')
+        pause_resume = self._pause_resume or self.printer.lookup_object('pause_resume')
         pause_resume.send_pause_command()
-        handler_gcode = self.gcodes.get(event_type)
-        self._exec_gcode("%s EVENTTIME=%s" % (handler_gcode, eventtime) if handler_gcode else None)
+        prefix = self._event_prefixes.get(event_type)
+        self._exec_gcode(prefix + str(eventtime) if prefix else None)
 
 
     def _exec_gcode(self, command):
@@ -117,28 +169,29 @@ class MmuRunoutHelper:
                 self.gcode.run_script(command)
             except Exception:
                 logging.exception("MMU: Error running mmu sensor handler: `%s`" % command)
-        self.min_event_systime = self.reactor.monotonic() + self.event_delay
+        self.min_event_systime = self._monotonic() + self.event_delay
 
 
     # Latest klipper v0.12.0-462 added the passing of eventtime
     #     old: note_filament_present(self, is_filament_present):
     #     new: note_filament_present(self, eventtime, is_filament_present):
-    def note_filament_present(self, *args):
-        if len(args) == 1:
-            eventtime = self.reactor.monotonic()
-            is_filament_present = args[0]
-        else:
-            eventtime = args[0]
-            is_filament_present = args[1]
+    def note_filament_present(self, eventtime, is_filament_present=None):
+        if is_filament_present is None: # Old single argument form
+            eventtime, is_filament_present = None, eventtime
 
         prev_filament_present = self.filament_present
-        self.filament_present = bool(is_filament_present)
+        is_present = bool(is_filament_present)
+        if is_present == prev_filament_present and self.button_handler is None:
+            return # Steady state and nobody wants every event
+        self.filament_present = is_present
+        if eventtime is None:
+            eventtime = self._monotonic() # Only read the clock once we know the event is needed
 
         # Button handlers are used for sync feedback state switches
         if self.button_handler and not self.button_handler_suspended:
             self.button_handler(eventtime, self.name, is_filament_present, self)
 
-        if prev_filament_present == is_filament_present:
+        if prev_filament_present == is_present:
             return
 
         # Don't handle too early or if disabled
@@ -146,42 +199,41 @@ class MmuRunoutHelper:
             self._process_state_change(eventtime, is_filament_present)
 
 
-    def _process_state_change(self, eventtime, is_filament_present):
-        # Determine "printing" status
-        now = self.reactor.monotonic()
+    # Determine "printing" status. One of these is bound to _is_printing once objects are known
+    def _is_printing_print_stats(self, now):
+        return self._print_stats.state == "printing"
+
+    def _is_printing_idle_timeout(self, now):
+        return self._idle_timeout.state == "Printing"
+
+    def _is_printing_lookup(self, now):
         print_stats = self.printer.lookup_object("print_stats", None)
         if print_stats is not None:
-            is_printing = print_stats.get_status(now)["state"] == "printing"
-        else:
-            is_printing = self.printer.lookup_object("idle_timeout").get_status(now)["state"] == "Printing"
+            return print_stats.get_status(now)["state"] == "printing"
+        return self.printer.lookup_object("idle_timeout").get_status(now)["state"] == "Printing"
 
-        insert_gcode = self.gcodes.get("insert")
-        remove_gcode = self.gcodes.get("remove")
-        runout_gcode = self.gcodes.get("runout")
 
-        if is_filament_present and insert_gcode: # Insert detected
+    def _process_state_change(self, eventtime, is_filament_present):
+        is_printing = self._is_printing(self._monotonic())
+
+        if is_filament_present and self._insert_prefix: # Insert detected
             if not is_printing or (is_printing and self.insert_remove_in_print):
                 #logging.info("MMU: filament sensor %s: insert event detected, Eventtime %.2f" % (self.name, eventtime))
-                self.min_event_systime = self.reactor.NEVER # Prevent more callbacks until this one is complete
-                self.reactor.register_callback(lambda reh: self._insert_event_handler(eventtime))
+                self._schedule_event(self._insert_event_handler, eventtime)
 
         else: # Remove or Runout detected
-            if is_printing and self.runout_suspended is False and runout_gcode:
+            if is_printing and self.runout_suspended is False and self._runout_prefix:
                 #logging.info("MMU: filament sensor %s: runout event detected, Eventtime %.2f" % (self.name, eventtime))
-                self.min_event_systime = self.reactor.NEVER # Prevent more callbacks until this one is complete
-                self.reactor.register_callback(lambda reh: self._runout_event_handler(eventtime, "runout"))
-            elif remove_gcode and (not is_printing or self.insert_remove_in_print):
+                self._schedule_event(self._runout_event_handler, eventtime, "runout")
+            elif self._remove_prefix and (not is_printing or self.insert_remove_in_print):
                 # Just a "remove" event
                 #logging.info("MMU: filament sensor %s: remove event detected, Eventtime %.2f" % (self.name, eventtime))
-                self.min_event_systime = self.reactor.NEVER # Prevent more callbacks until this one is complete
-                self.reactor.register_callback(lambda reh: self._remove_event_handler(eventtime))
+                self._schedule_event(self._remove_event_handler, eventtime)
 
 
     def note_clog_tangle(self, event_type):
         #logging.info("MMU: filament sensor %s: %s event detected, Eventtime %.2f" % (self.name, event_type, eventtime))
-        now = self.reactor.monotonic()
-        self.min_event_systime = self.reactor.NEVER # Prevent more callbacks until this one is complete
-        self.reactor.register_callback(lambda reh: self._runout_event_handler(now, event_type))
+        self._schedule_event(self._runout_event_handler, self._monotonic(), event_type)
 
 
     def enable_runout(self, restore):
@@ -193,11 +245,17 @@ class MmuRunoutHelper:
 
 
     def get_status(self, eventtime=None):
-        return {
-            "filament_detected": bool(self.filament_present),
-            "enabled": bool(self.sensor_enabled),
-            "runout_suspended": bool(self.runout_suspended),
-        }
+        # Polled by webhooks for every sensor so reuse the last dict until state changes. A new dict is
+        # built rather than updated in place because webhooks compares against the previous one it got
+        key = (self.filament_present, self.sensor_enabled, self.runout_suspended)
+        if key != self._status_key:
+            self._status_key = key
+            self._status = {
+                "filament_detected": bool(self.filament_present),
+                "enabled": bool(self.sensor_enabled),
+                "runout_suspended": bool(self.runout_suspended),
+            }
+        return self._status
 
 
     cmd_QUERY_FILAMENT_SENSOR_help = "Query the status of the Filament Sensor"
@@ -254,6 +312,13 @@ class MmuProportionalSensor:
             self._d_pos = max(self._neutral_point - max_compression, eps)
             self._d_neg = max(max_tension - self._neutral_point, eps)
 
+        # Fold direction and span into per-side scale factors so mapping is a single multiply
+        self._direction = -1.0 if self._reversed else 1.0
+        self._scale_pos = 1.0 / self._d_pos
+        self._scale_neg = 1.0 / self._d_neg
+        if self._gamma != 1.0:
+            self._map_reading = self._map_reading_shaped # Specialize so linear case has no shaping test
+
         # State
         self.value_raw = 0.0 # Raw ADC value
         self.value = 0.0     # In [-1.0, 1.0]
@@ -277,16 +342,11 @@ class MmuProportionalSensor:
                 self.adc.setup_adc_callback(self._report_time, self._adc_callback)
 
         # Attach runout_helper (no gcode actions; just enable/disable plumbing to remove UI nag)
-        clog_gcode   = ("%s SENSOR=%s" % (CLOG_GCODE,   name))
-        tangle_gcode = ("%s SENSOR=%s" % (TANGLE_GCODE, name))
         self.runout_helper = MmuRunoutHelper(
             self.printer,
             self.name,                  # Name exposed to QUERY_/SET_FILAMENT_SENSOR
             0,                          # Event_delay (not used here)
-            {
-                "clog":   clog_gcode,
-                "tangle": tangle_gcode,
-            },
+            _sensor_gcodes(name, clog=True, tangle=True),
             insert_remove_in_print=False,
             button_handler=None,       # No button handler for analog
             switch_pin=self._pin
@@ -296,24 +356,20 @@ class MmuProportionalSensor:
         self.printer.add_object(self.name, self)
 
     def _map_reading(self, v_raw):
-        n = self._neutral_point
+        # Map around neutral_point into [-1, 1] (positive towards compression)
+        d = (v_raw - self._neutral_point) * self._direction
+        y = d * self._scale_pos if d >= 0 else d * self._scale_neg
 
-        v = float(v_raw)
-        # Map around neutral_point into [-1, 1]
-        if not self._reversed:
-            if v >= n:
-                y = (v - n) / self._d_pos
-            else:
-                y = -(n - v) / self._d_neg
-        else:
-            if v <= n:
-                y = (n - v) / self._d_pos
-            else:
-                y = -(v - n) / self._d_neg
+        # Clamp
+        if y < -1.0: y = -1.0
+        if y >  1.0: y =  1.0
+        return y
 
-        # Optional shaping (gamma=1 => linear)
-        if self._gamma != 1.0:
-            y = (abs(y) ** self._gamma) * (1.0 if y >= 0 else -1.0)
+    def _map_reading_shaped(self, v_raw):
+        # As _map_reading() but with gamma shaping (used when gamma != 1)
+        d = (v_raw - self._neutral_point) * self._direction
+        y = d * self._scale_pos if d >= 0 else d * self._scale_neg
+        y = (abs(y) ** self._gamma) * (1.0 if y >= 0 else -1.0)
 
         # Clamp
         if y < -1.0: y = -1.0
@@ -331,17 +387,17 @@ class MmuProportionalSensor:
         else:
             raise TypeError("_adc_callback expected (read_time, read_value) or (samples), got %d args" % len(args))
 
-        self.value_raw = float(read_value)
-        self.value = self._map_reading(read_value) # Mapped & scaled value
+        self.value_raw = read_value # Klipper already reports ADC values as float
+        self.value = value = self._map_reading(read_value) # Mapped & scaled value
         
         # Publish sync-feedback event immediately if extreme to match switch sensors
         # TODO really extreme should be determined by is_extreme() in mmu_sync_feedback manager (with hysteresis), but object hasn't been created yet
         # TODO so for now, use absolute extremes
-        if abs(self.value) >= 1.0:
-            extreme = 1 if self.value > 0 else -1
+        if value >= 1.0 or value <= -1.0:
+            extreme = 1 if value > 0 else -1
             if extreme != self._last_extreme: # Avoid repeated events
                 self._last_extreme = extreme
-                self.printer.send_event("mmu:sync_feedback", read_time, self.value)
+                self.printer.send_event("mmu:sync_feedback", read_time, value)
 
     def get_status(self, eventtime):
         return {
@@ -378,22 +434,11 @@ class MmuAdcSwitchSensor:
         a_min, a_max = a_range
         buttons.register_adc_button(switch_pin, a_min, a_max, a_pullup, self._button_handler)
         self.name = name = "%s_%d" % (name_prefix, gate)
-        insert_gcode = ("%s SENSOR=%s%s" % (INSERT_GCODE, name, (" GATE=%d" % gate) if gate is not None else "")) if insert else None
-        remove_gcode = ("%s SENSOR=%s%s" % (REMOVE_GCODE, name, (" GATE=%d" % gate) if gate is not None else "")) if remove else None
-        runout_gcode = ("%s SENSOR=%s%s" % (RUNOUT_GCODE, name, (" GATE=%d" % gate) if gate is not None else "")) if runout else None
-        clog_gcode   = ("%s SENSOR=%s%s" % (CLOG_GCODE,   name, (" GATE=%d" % gate) if gate is not None else "")) if clog else None
-        tangle_gcode = ("%s SENSOR=%s%s" % (TANGLE_GCODE, name, (" GATE=%d" % gate) if gate is not None else "")) if tangle else None
         self.runout_helper = MmuRunoutHelper(
             self.printer,
             name,
             event_delay,
-            {
-                "insert": insert_gcode,
-                "remove": remove_gcode,
-                "runout": runout_gcode,
-                "clog":   clog_gcode,
-                "tangle": tangle_gcode,
-            },
+            _sensor_gcodes(name, gate, insert, remove, runout, clog, tangle),
             insert_remove_in_print,
             button_handler,
             switch_pin,
@@ -403,9 +448,10 @@ class MmuAdcSwitchSensor:
 
     def _button_handler(self, eventtime, state):
         self.runout_helper.note_filament_present(eventtime, state)
-        if self._trigger_completion is not None:
+        completion = self._trigger_completion
+        if completion is not None:
             self._last_trigger_time = eventtime
-            self._trigger_completion.complete(True)
+            completion.complete(True)
 
 
     # Required to implement an endstop -------
@@ -455,11 +501,26 @@ class MmuAdcSwitchSensor:
 # Standalone Hall Filament Sensor Endstop using Multi-Use Pins
 # Can coexists with standard Klipper hall_filament_width_sensor by sharing the ADC pins
 class MmuHallEndstop:
+
+    # Fixed attribute layout because the ADC callbacks run at the sample report rate
+    __slots__ = (
+        'printer', 'reactor', 'name', 'sample_time', 'sample_count', 'report_time',
+        'pin1_name', 'pin2_name', 'dia1', 'rawdia1', 'dia2', 'rawdia2', '_slope', '_bias', 'hall_min_diameter',
+        '_threshold_on', '_threshold_off', '_confirm_count', '_pending_count', '_reading2_processed',
+        '_skip_delta_raw', '_skip_margin_dia',
+        'lastFilamentWidthReading', 'lastFilamentWidthReading2', 'diameter', 'is_active',
+        '_steppers', '_trigger_completion', '_last_trigger_time', '_homing', '_triggered',
+        'mcu_adc', 'mcu_adc2', 'runout_helper',
+    )
+
+    SKIP_FRACTION = 0.05 # Secondary channel diameter change, as a fraction of hall_min_diameter, ignored while homing
+
     def __init__(self, config, name, pin1, pin2, cal_dia1, raw_dia1, cal_dia2, raw_dia2,
-                 hall_runout_dia=1.,
+                 hall_runout_dia=1., hall_hysteresis=0., hall_confirm_count=1,
                  insert=False, remove=False, runout=False, clog=False, tangle=False):
 
         self.printer = config.get_printer()
+        self.reactor = self.printer.get_reactor()
         self.name = name
 
         # Configurable sampling for fast endstop response
@@ -475,11 +536,28 @@ class MmuHallEndstop:
         self.rawdia1 = raw_dia1
         self.dia2 = cal_dia2
         self.rawdia2 = raw_dia2
+        # Calibration is constant so reduce it to diameter = slope * raw_sum + bias
+        try:
+            self._slope = (self.dia2 - self.dia1) / (self.rawdia2 - self.rawdia1)
+            self._bias = self.dia1 - self._slope * self.rawdia1
+        except ZeroDivisionError:
+            self._slope, self._bias = 0., 1.75 # Degenerate calibration, assume nominal diameter
         self.hall_min_diameter = hall_runout_dia
+        self._threshold_on = hall_runout_dia + hall_hysteresis  # Diameter to declare filament present
+        self._threshold_off = hall_runout_dia - hall_hysteresis # Diameter to declare filament absent
+        self._confirm_count = hall_confirm_count # Consecutive samples needed before reporting a change
+        self._pending_count = 0
+        # While homing a secondary reading within _skip_delta_raw of the last processed one moves the
+        # diameter by less than skip_dia, so it can't cross the hysteresis band while the diameter is
+        # further than that from it. Degenerate calibration (slope 0) never skips
+        skip_dia = hall_runout_dia * self.SKIP_FRACTION
+        self._skip_delta_raw = skip_dia / abs(self._slope) if self._slope else 0.
+        self._skip_margin_dia = hall_hysteresis + skip_dia
 
         # State
         self.lastFilamentWidthReading = 0
         self.lastFilamentWidthReading2 = 0
+        self._reading2_processed = 0. # Secondary reading last used for a homing update
         self.diameter = 0
         self.is_active = True # Always active for endstop purposes? or should be toggleable?
 
@@ -493,44 +571,29 @@ class MmuHallEndstop:
         # Setup Hardware (Multi-Use)
         ppins = self.printer.lookup_object('pins')
 
-        _kalico = hasattr(self.adc, "setup_minmax") # Kalico and older klipper
         # ADC 1
+        self.mcu_adc = None
         if self.pin1_name:
             ppins.allow_multi_use_pin(self.pin1_name)
             self.mcu_adc = ppins.setup_pin('adc', self.pin1_name)
-            if _kalico:
-                self.mcu_adc.setup_minmax(self.sample_time, self.sample_count)
-            else:
-                self.mcu_adc.setup_adc_sample(self.sample_time, self.sample_count)
-            self.mcu_adc.setup_adc_callback(self.report_time, self.adc_callback)
+            self._setup_adc(self.mcu_adc, self.adc_callback)
 
         # ADC 2 (Optional)
         self.mcu_adc2 = None
         if self.pin2_name:
             ppins.allow_multi_use_pin(self.pin2_name)
             self.mcu_adc2 = ppins.setup_pin('adc', self.pin2_name)
-            if _kalico:
-                self.mcu_adc2.setup_minmax(self.sample_time, self.sample_count)
-            else:
-                self.mcu_adc2.setup_adc_sample(self.sample_time, self.sample_count)
-            self.mcu_adc2.setup_adc_callback(self.report_time, self.adc2_callback)
+            self._setup_adc(self.mcu_adc2, self.adc2_callback)
 
         # Setup runout helper/virtual sensor for MMU integration
         event_delay = 0.5
-        insert_gcode = ("%s SENSOR=%s" % (INSERT_GCODE, name)) if insert else None
-        remove_gcode = ("%s SENSOR=%s" % (REMOVE_GCODE, name)) if remove else None
-        runout_gcode = ("%s SENSOR=%s" % (RUNOUT_GCODE, name)) if runout else None
 
         # We pass "None" for switch_pin because we manage the pin state via ADC logic
         self.runout_helper = MmuRunoutHelper(
             self.printer,
             name,
             event_delay,
-            {
-                "insert": insert_gcode,
-                "remove": remove_gcode,
-                "runout": runout_gcode
-            },
+            _sensor_gcodes(name, insert=insert, remove=remove, runout=runout, clog=clog, tangle=tangle),
             insert_remove_in_print=False,
             button_handler=None,
             switch_pin=None
@@ -538,46 +601,86 @@ class MmuHallEndstop:
 
         self.printer.add_object("mmu_hall_endstop %s" % name, self)
 
-    def _calc_diameter(self):
-        # Duplicate of Klipper hall_filament_width_sensor logic
-        try:
-            val_sum = self.lastFilamentWidthReading + self.lastFilamentWidthReading2
-            slope = (self.dia2 - self.dia1) / (self.rawdia2 - self.rawdia1)
-            diameter_new = round(slope * (val_sum - self.rawdia1) + self.dia1, 2)
-            # Use same smoothing factor as Klipper? Or faster for endstop?
-            # Klipper: self.diameter = (5.0 * self.diameter + diameter_new) / 6
-            # For endstop we probably want instant reaction or less smoothing
-            self.diameter = (2.0 * self.diameter + diameter_new) / 3 # Slightly faster smoothing
-        except ZeroDivisionError:
-            self.diameter = 1.75 # Default fallback
-
-    def adc_callback(self, read_time, read_value):
-        self.lastFilamentWidthReading = round(read_value * 10000)
-        self._calc_diameter()
-        self._check_trigger(read_time)
-
-    def adc2_callback(self, read_time, read_value):
-        self.lastFilamentWidthReading2 = round(read_value * 10000)
-        self._calc_diameter()
-        self._check_trigger(read_time)
+    def _setup_adc(self, mcu_adc, callback):
+        # Same sample settings for both channels, resolved once from config
+        if hasattr(mcu_adc, "setup_minmax"):
+            # Kalico and older klipper
+            mcu_adc.setup_minmax(self.sample_time, self.sample_count)
+            mcu_adc.setup_adc_callback(self.report_time, callback)
+        else:
+            try:
+                # New klipper (>= v0.13.0-557)
+                mcu_adc.setup_adc_sample(self.report_time, self.sample_time, self.sample_count)
+                mcu_adc.setup_adc_callback(callback)
+            except TypeError:
+                # A few versions of klipper had these signatures
+                mcu_adc.setup_adc_sample(self.sample_time, self.sample_count)
+                mcu_adc.setup_adc_callback(self.report_time, callback)
 
-    def _check_trigger(self, eventtime):
-        is_present = self.diameter > self.hall_min_diameter
-        self.runout_helper.note_filament_present(eventtime, is_present)
+    def adc_callback(self, *args):
+        # Old klipper: adc_callback(read_time, read_value)
+        # New klipper: adc_callback(samples) where samples is a list of (read_time, read_value)
+        if len(args) == 1:
+            read_time, read_value = args[0][-1]
+        else:
+            read_time, read_value = args
+        self.lastFilamentWidthReading = read_value * 10000. # Raw units used by hall_raw_dia calibration
+        self._update(read_time)
 
+    def adc2_callback(self, *args):
+        if len(args) == 1:
+            read_time, read_value = args[0][-1]
+        else:
+            read_time, read_value = args
+        # Secondary channel normally only records its latest reading. The primary channel reports at the
+        # same rate and drives the update, so each sample pair is filtered once. While homing both
+        # channels update so a change on either is seen as early as possible
+        reading = self.lastFilamentWidthReading2 = read_value * 10000. # Raw units used by hall_raw_dia calibration
         if self._homing:
-            if is_present == self._triggered:
-                if self._trigger_completion is not None:
-                    self._last_trigger_time = eventtime
-                    self._trigger_completion.complete(True)
-                    self._trigger_completion = None
+            # Skip the update for negligible changes well away from the threshold. The reading is still
+            # stored so the primary channel uses it (delta is measured from the last processed reading)
+            if (abs(reading - self._reading2_processed) < self._skip_delta_raw
+                    and abs(self.diameter - self.hall_min_diameter) > self._skip_margin_dia):
+                return
+            self._reading2_processed = reading
+            self._update(read_time)
+
+    def _update(self, eventtime):
+        # Diameter calc is a duplicate of Klipper hall_filament_width_sensor logic. Klipper smooths with
+        # (5.0 * diameter + diameter_new) / 6 but for an endstop we want a faster reaction so use
+        # (2.0 * diameter + diameter_new) / 3. Unrounded, result is smoothed anyway
+        diameter_new = self._slope * (self.lastFilamentWidthReading + self.lastFilamentWidthReading2) + self._bias
+        self.diameter = diameter = (2.0 * self.diameter + diameter_new) * (1. / 3)
+
+        rh = self.runout_helper
+        # Hysteresis band around hall_min_diameter so noise near the threshold doesn't toggle state
+        is_present = diameter > (self._threshold_off if rh.filament_present else self._threshold_on)
+        if is_present != rh.filament_present:
+            # Debounce: only report once the new state has been seen on enough consecutive samples. Not
+            # while homing so the endstop trigger and sensor state agree (and outside homing only the
+            # primary channel gets here so the count is in sample pairs)
+            self._pending_count += 1
+            if self._homing or self._pending_count >= self._confirm_count:
+                self._pending_count = 0
+                rh.note_filament_present(eventtime, is_present)
+        else:
+            self._pending_count = 0
+            if rh.button_handler is not None:
+                rh.note_filament_present(eventtime, is_present) # Steady state has nothing to notify otherwise
+
+        if self._homing and is_present == self._triggered:
+            completion = self._trigger_completion
+            if completion is not None:
+                self._last_trigger_time = eventtime
+                completion.complete(True)
+                self._trigger_completion = None
 
     def get_status(self, eventtime):
-        status = self.runout_helper.get_status(eventtime)
-        status.update({
-            "Diameter": self.diameter,
-            "Raw": (self.lastFilamentWidthReading + self.lastFilamentWidthReading2)
-        })
+        # Webhooks keeps the previous dict to diff against so this must be a new dict each poll (and the
+        # helper's dict is shared) but fill it directly rather than via a temporary update() dict
+        status = dict(self.runout_helper.get_status(eventtime))
+        status["Diameter"] = self.diameter
+        status["Raw"] = int(round(self.lastFilamentWidthReading + self.lastFilamentWidthReading2)) # Readings are kept unrounded
         return status
 
     # Required to implement a HH MMU endstop -------
@@ -599,6 +702,7 @@ class MmuHallEndstop:
         self._last_trigger_time = None
         self._homing = True
         self._triggered = triggered
+        self._reading2_processed = self.lastFilamentWidthReading2 # Primary channel has already used it
 
         if self.runout_helper.filament_present == self._triggered:
             self._last_trigger_time = print_time
@@ -623,26 +727,28 @@ class MmuSensors:
         from .mmu import Mmu # For sensor names
 
         self.printer = config.get_printer()
+        self._send_event = self.printer.send_event # Bound once for the sync-feedback callbacks
         self.sensors = {}
+        self._empty_pins = {} # Pin name -> resolves to empty alias
+        self._sync_peers = {} # Sync-feedback switch sensor name -> opposing sensor's runout helper (or None), resolved on first event
+        self._sync_sensor_names = (Mmu.SENSOR_TENSION, Mmu.SENSOR_COMPRESSION) # Mmu can't be imported at module load (circular)
         mmu_machine = self.printer.lookup_object("mmu_machine", None)
         num_units = mmu_machine.num_units if mmu_machine else 1
         event_delay = config.get('event_delay', 0.5)
 
         # Setup "mmu_pre_gate" sensors...
-        for gate in range(23):
+        for gate in self._get_configured_gates(config, 'pre_gate_switch_pin_'):
             switch_pin = config.get('pre_gate_switch_pin_%d' % gate, None)
             if switch_pin:
                 self._create_mmu_sensor(config, Mmu.SENSOR_PRE_GATE_PREFIX, gate, switch_pin, event_delay, insert=True, remove=True, runout=True, insert_remove_in_print=True)
 
         # Setup single "mmu_gate" sensor(s)...
-        switch_pins = list(config.getlist('gate_switch_pin', []))
+        switch_pins = self._get_unit_pins(config, 'gate_switch_pin', num_units)
         if switch_pins:
-            if len(switch_pins) not in [1, num_units]:
-                raise config.error("Invalid number of pins specified with gate_switch_pin. Expected 1 or %d but counted %d" % (num_units, len(switch_pins)))
             self._create_mmu_sensor(config, Mmu.SENSOR_GATE, None, switch_pins, event_delay, runout=True)
 
         # Setup "mmu_gear" sensors...
-        for gate in range(23):
+        for gate in self._get_configured_gates(config, 'post_gear_switch_pin_'):
             switch_pin = config.get('post_gear_switch_pin_%d' % gate, None)
             if switch_pin:
                 a_range = config.getfloatlist('post_gear_analog_range_%d' % gate, None, count=2)
@@ -653,15 +759,14 @@ class MmuSensors:
                 else:
                     self._create_mmu_sensor(config, Mmu.SENSOR_GEAR_PREFIX, gate, switch_pin, event_delay, runout=True)
 
-        # Setup single extruder (entrance) sensor...
-        switch_pin = config.get('extruder_switch_pin', None)
-        if switch_pin:
-            self._create_mmu_sensor(config, Mmu.SENSOR_EXTRUDER_ENTRY, None, switch_pin, event_delay, insert=True, runout=True)
-
-        # Setup single toolhead sensor...
-        switch_pin = config.get('toolhead_switch_pin', None)
-        if switch_pin:
-            self._create_mmu_sensor(config, Mmu.SENSOR_TOOLHEAD, None, switch_pin, event_delay)
+        # Setup single extruder (entrance) and toolhead sensors...
+        for option, name, events in (
+            ('extruder_switch_pin', Mmu.SENSOR_EXTRUDER_ENTRY, {'insert': True, 'runout': True}),
+            ('toolhead_switch_pin', Mmu.SENSOR_TOOLHEAD,       {}),
+        ):
+            switch_pin = config.get(option, None)
+            if switch_pin:
+                self._create_mmu_sensor(config, name, None, switch_pin, event_delay, **events)
 
         # For Qidi printers or any other that use a hall_filament_width_sensor as an endstop
         hall_sensor_endstop = config.get('hall_sensor_endstop', None)
@@ -682,25 +787,25 @@ class MmuSensors:
             self.hall_rawdia1 = config.getint('hall_raw_dia1', 9500)
             self.hall_rawdia2 = config.getint('hall_raw_dia2', 10500)
             self.hall_runout_dia = config.getfloat('hall_min_diameter', 1.0)
+            self.hall_hysteresis = config.getfloat('hall_hysteresis', 0., minval=0.)
+            self.hall_confirm_count = config.getint('hall_confirm_count', 1, minval=1)
             # self.hall_runout_dia_max = config.getfloat('hall_max_diameter', 2.0) - Unused for trigger
 
             s = MmuHallEndstop(config, target_name, self.hall_pin1, self.hall_pin2,
                                self.hall_dia1, self.hall_rawdia1, self.hall_dia2, self.hall_rawdia2,
-                               hall_runout_dia=self.hall_runout_dia,
+                               hall_runout_dia=self.hall_runout_dia, hall_hysteresis=self.hall_hysteresis,
+                               hall_confirm_count=self.hall_confirm_count,
                                insert=True, runout=True)
             self.sensors[target_name] = s            
 
         # Setup motor syncing feedback sensors...
-        switch_pins = list(config.getlist('sync_feedback_tension_pin', []))
-        if switch_pins:
-            if len(switch_pins) not in [1, num_units]:
-                raise config.error("Invalid number of pins specified with sync_feedback_tension_pin. Expected 1 or %d but counted %d" % (num_units, len(switch_pins)))
-            self._create_mmu_sensor(config, Mmu.SENSOR_TENSION, None, switch_pins, 0, clog=True, tangle=True, button_handler=self._sync_tension_callback)
-        switch_pins = list(config.getlist('sync_feedback_compression_pin', []))
-        if switch_pins:
-            if len(switch_pins) not in [1, num_units]:
-                raise config.error("Invalid number of pins specified with sync_feedback_compression_pin. Expected 1 or %d but counted %d" % (num_units, len(switch_pins)))
-            self._create_mmu_sensor(config, Mmu.SENSOR_COMPRESSION, None, switch_pins, 0, clog=True, tangle=True, button_handler=self._sync_compression_callback)
+        for option, name, button_handler in (
+            ('sync_feedback_tension_pin',     Mmu.SENSOR_TENSION,     self._sync_tension_callback),
+            ('sync_feedback_compression_pin', Mmu.SENSOR_COMPRESSION, self._sync_compression_callback),
+        ):
+            switch_pins = self._get_unit_pins(config, option, num_units)
+            if switch_pins:
+                self._create_mmu_sensor(config, name, None, switch_pins, 0, clog=True, tangle=True, button_handler=button_handler)
         
         # Setup analog (proportional) sync feedback
         # Uses single analog input; value scaled in [-1, 1]
@@ -709,99 +814,135 @@ class MmuSensors:
             self.sensors[Mmu.SENSOR_PROPORTIONAL] = MmuProportionalSensor(config, name=Mmu.SENSOR_PROPORTIONAL)
 
 
+    def _get_configured_gates(self, config, prefix, max_gates=23):
+        """
+        Return sorted gate numbers that have a per-gate option set rather than probing every possible gate
+        """
+        gates = []
+        for option in config.get_prefix_options(prefix):
+            suffix = option[len(prefix):]
+            if suffix.isdigit() and int(suffix) < max_gates:
+                gates.append(int(suffix))
+        return sorted(gates)
+
+
+    def _get_unit_pins(self, config, option, num_units):
+        """
+        Return list of pins for a sensor that can be specified once or once per mmu unit
+        """
+        switch_pins = list(config.getlist(option, []))
+        if switch_pins and len(switch_pins) not in [1, num_units]:
+            raise config.error("Invalid number of pins specified with %s. Expected 1 or %d but counted %d" % (option, num_units, len(switch_pins)))
+        return switch_pins
+
+
     def _create_mmu_sensor(
         self, config, name_prefix, gate, switch_pins, event_delay,
         insert=False, remove=False, runout=False, clog=False, tangle=False,
         insert_remove_in_print=False, button_handler=None,
     ):
         switch_pins = [switch_pins] if not isinstance(switch_pins, list) else switch_pins
-        for unit, switch_pin in enumerate(switch_pins):
-            if not self._is_empty_pin(switch_pin):
-                # name must match mmu_sensor_manager
-                if gate is not None:
-                    name = "%s_%d" % (name_prefix, gate)
-                elif len(switch_pins) > 1:
-                    name = "unit_%d_%s" % (unit, name_prefix)
-                else:
-                    name = name_prefix
-                sensor = name if gate is not None else "%s_sensor" % name
-                section = "filament_switch_sensor %s" % sensor
-                config.fileconfig.add_section(section)
-                config.fileconfig.set(section, "switch_pin", switch_pin)
-                config.fileconfig.set(section, "pause_on_runout", "False")
-                fs = self.printer.load_object(config, section)
-
-                # Replace with custom runout_helper because of state specific behavior
-                insert_gcode = ("%s SENSOR=%s%s" % (INSERT_GCODE, name, (" GATE=%d" % gate) if gate is not None else "")) if insert else None
-                remove_gcode = ("%s SENSOR=%s%s" % (REMOVE_GCODE, name, (" GATE=%d" % gate) if gate is not None else "")) if remove else None
-                runout_gcode = ("%s SENSOR=%s%s" % (RUNOUT_GCODE, name, (" GATE=%d" % gate) if gate is not None else "")) if runout else None
-                clog_gcode   = ("%s SENSOR=%s%s" % (CLOG_GCODE,   name, (" GATE=%d" % gate) if gate is not None else "")) if clog else None
-                tangle_gcode = ("%s SENSOR=%s%s" % (TANGLE_GCODE, name, (" GATE=%d" % gate) if gate is not None else "")) if tangle else None
-                ro_helper = MmuRunoutHelper(
-                    self.printer,
-                    sensor,
-                    event_delay,
-                    {
-                        "insert": insert_gcode,
-                        "remove": remove_gcode,
-                        "runout": runout_gcode,
-                        "clog":   clog_gcode,
-                        "tangle": tangle_gcode,
-                    },
-                    insert_remove_in_print,
-                    button_handler,
-                    switch_pin
-                )
-                fs.runout_helper = ro_helper
-                fs.get_status = ro_helper.get_status
-                self.sensors[name] = fs
+        multi_unit = len(switch_pins) > 1
+        unit_pins = [(unit, pin) for unit, pin in enumerate(switch_pins) if not self._is_empty_pin(pin)]
+        if not unit_pins:
+            return
+
+        self._sync_peers.clear() # New sensor may be the peer of one already seen
+        for unit, switch_pin in unit_pins:
+            # name must match mmu_sensor_manager
+            if gate is not None:
+                name = "%s_%d" % (name_prefix, gate)
+            elif multi_unit:
+                name = "unit_%d_%s" % (unit, name_prefix)
+            else:
+                name = name_prefix
+            sensor = name if gate is not None else "%s_sensor" % name
+            section = "filament_switch_sensor %s" % sensor
+            config.fileconfig.add_section(section)
+            config.fileconfig.set(section, "switch_pin", switch_pin)
+            config.fileconfig.set(section, "pause_on_runout", "False")
+            fs = self.printer.load_object(config, section)
+
+            # Replace with custom runout_helper because of state specific behavior
+            ro_helper = MmuRunoutHelper(
+                self.printer,
+                sensor,
+                event_delay,
+                _sensor_gcodes(name, gate, insert, remove, runout, clog, tangle),
+                insert_remove_in_print,
+                button_handler,
+                switch_pin
+            )
+            fs.runout_helper = ro_helper
+            fs.get_status = ro_helper.get_status
+            self.sensors[name] = fs
+
+
+    def remove_sensor(self, name):
+        """
+        Forget a sensor created by _create_mmu_sensor() (used to tidy up temporary test sensors)
+        """
+        self.sensors.pop(name, None)
+        self._sync_peers.clear() # Cached peer may be the removed sensor
 
 
     def _is_empty_pin(self, switch_pin):
         if switch_pin == '': return True
-        ppins = self.printer.lookup_object('pins')
-        pin_params = ppins.parse_pin(switch_pin, can_invert=True, can_pullup=True)
-        pin_resolver = ppins.get_pin_resolver(pin_params['chip_name'])
-        real_pin = pin_resolver.aliases.get(pin_params['pin'], '_real_')
-        return real_pin == ''
+        try:
+            return self._empty_pins[switch_pin]
+        except KeyError:
+            ppins = self.printer.lookup_object('pins')
+            pin_params = ppins.parse_pin(switch_pin, can_invert=True, can_pullup=True)
+            pin_resolver = ppins.get_pin_resolver(pin_params['chip_name'])
+            real_pin = pin_resolver.aliases.get(pin_params['pin'], '_real_')
+            is_empty = self._empty_pins[switch_pin] = real_pin == ''
+            return is_empty
+
+
+    def _sync_peer_helper(self, sensor_name):
+        """
+        Return the runout helper of the opposing sync-feedback switch sensor (tension <-> compression)
+        for the named sensor or None if there isn't one
+        """
+        try:
+            return self._sync_peers[sensor_name]
+        except KeyError:
+            tension, compression = self._sync_sensor_names
+            if tension in sensor_name:
+                peer_name = sensor_name.replace(tension, compression)
+            else:
+                peer_name = sensor_name.replace(compression, tension)
+            peer = self.printer.lookup_object("filament_switch_sensor %s" % peer_name, None)
+            helper = self._sync_peers[sensor_name] = peer.runout_helper if peer is not None else None
+            return helper
 
 
     def _sync_tension_callback(self, eventtime, t_sensor_name, tension_state, runout_helper):
         """
         Button event handler for sync-feedback tension switch
         """
-        from .mmu import Mmu # For sensor names
-        c_sensor_name = t_sensor_name.replace(Mmu.SENSOR_TENSION, Mmu.SENSOR_COMPRESSION)
-        compression_sensor = self.printer.lookup_object("filament_switch_sensor %s" % c_sensor_name, None)
-        compression_enabled = compression_sensor.runout_helper.sensor_enabled if compression_sensor else False
-        compression_state = compression_sensor.runout_helper.filament_present if compression_enabled else False
+        crh = self._sync_peer_helper(t_sensor_name)
+        compression_state = crh is not None and crh.sensor_enabled and crh.filament_present
 
-        if compression_enabled:
-            event_value = 0 if tension_state == compression_state else (-1 if tension_state else 1) # {-1,0,1}
-        else:
-            event_value = -tension_state # {0,-1}
+        # A disabled/missing compression sensor contributes 0 so the result is {-1,0,1} or {0,-1}
+        event_value = int(bool(compression_state)) - int(bool(tension_state))
 
         # Send event now so it is processed as early as possible
-        self.printer.send_event("mmu:sync_feedback", eventtime, event_value)
+        self._send_event("mmu:sync_feedback", eventtime, event_value)
 
 
     def _sync_compression_callback(self, eventtime, c_sensor_name, compression_state, runout_helper):
         """
         Button event handler for sync-feedback compression switch
         """
-        from .mmu import Mmu
-        t_sensor_name = c_sensor_name.replace(Mmu.SENSOR_COMPRESSION, Mmu.SENSOR_TENSION)
-        tension_sensor = self.printer.lookup_object("filament_switch_sensor %s" % t_sensor_name, None)
-        tension_enabled = tension_sensor.runout_helper.sensor_enabled if tension_sensor else False
-        tension_state = tension_sensor.runout_helper.filament_present if tension_enabled else False
-
-        if tension_enabled:
-            event_value = 0 if compression_state == tension_state else (1 if compression_state else -1) # {-1,0,1}
-        else:
-            event_value = compression_state # {1,0}
+        trh = self._sync_peer_helper(c_sensor_name)
+        tension_state = trh is not None and trh.sensor_enabled and trh.filament_present
+
+        # A disabled/missing tension sensor contributes 0 so the result is {-1,0,1} or {1,0}
+        event_value = int(bool(compression_state)) - int(bool(tension_state))
 
         # Send event now so it is processed as early as possible
-        self.printer.send_event("mmu:sync_feedback", eventtime, event_value)
+        self._send_event("mmu:sync_feedback", eventtime, event_value)
 
 
 def load_config(config):